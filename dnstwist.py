@@ -35,14 +35,19 @@ socket.setdefaulttimeout(12.0)
 import signal
 import time
 import argparse
+import concurrent.futures
+import functools
 import threading
 import os
 import json
+import csv
 import queue
+import random
+import select
 import urllib.request
 import urllib.parse
 import gzip
-from io import BytesIO
+from io import BytesIO, StringIO
 from datetime import datetime
 
 def _debug(msg):
@@ -69,6 +74,9 @@ except ImportError as e:
 try:
 	from dns.resolver import Resolver, NXDOMAIN, NoNameservers
 	import dns.rdatatype
+	import dns.message
+	import dns.rcode
+	import dns.flags
 	from dns.exception import DNSException
 	MODULE_DNSPYTHON = True
 except ImportError as e:
@@ -76,6 +84,16 @@ except ImportError as e:
 	MODULE_DNSPYTHON = False
 
 GEOLITE2_MMDB = os.environ.get('GEOLITE2_MMDB' , os.path.join(os.path.dirname(__file__), 'GeoLite2-Country.mmdb'))
+_geoip_lock = threading.Lock()
+_geoip_reader = None
+def _geoip_open(opener):
+	# the database is read-only, so one handle is shared by all threads
+	global _geoip_reader
+	with _geoip_lock:
+		if _geoip_reader is None:
+			_geoip_reader = opener()
+		return _geoip_reader
+
 try:
 	import geoip2.database
 	_ = geoip2.database.Reader(GEOLITE2_MMDB)
@@ -91,14 +109,14 @@ except Exception as e:
 		MODULE_GEOIP = True
 		class geoip:
 			def __init__(self):
-				self.reader = GeoIP.new(GeoIP.GEOIP_MEMORY_CACHE)
+				self.reader = _geoip_open(lambda: GeoIP.new(GeoIP.GEOIP_MEMORY_CACHE))
 			def country_by_addr(self, ipaddr):
 				return self.reader.country_name_by_addr(ipaddr)
 else:
 	MODULE_GEOIP = True
 	class geoip:
 		def __init__(self):
-			self.reader = geoip2.database.Reader(GEOLITE2_MMDB)
+			self.reader = _geoip_open(lambda: geoip2.database.Reader(GEOLITE2_MMDB))
 		def country_by_addr(self, ipaddr):
 			return self.reader.country(ipaddr).country.name
 
@@ -121,6 +139,13 @@ except ImportError as e:
 	_debug(e)
 	MODULE_TLSH = False
 
+try:
+	from tld import parse_tld
+	MODULE_TLD = True
+except ImportError as e:
+	_debug(e)
+	MODULE_TLD = False
+
 try:
 	import idna
 except ImportError as e:
@@ -135,10 +160,12 @@ except ImportError as e:
 
 
 VALID_FQDN_REGEX = re.compile(r'(?=^.{4,253}$)(^((?!-)[a-z0-9-]{1,63}(?<!-)\.)+[a-z0-9-]{2,63}$)', re.IGNORECASE)
+COMMON_SLD = frozenset(['org', 'com', 'net', 'gov', 'edu', 'co', 'mil', 'nom', 'ac', 'info', 'biz'])
 USER_AGENT_STRING = 'Mozilla/5.0 ({} {}-bit) dnstwist/{}'.format(sys.platform, sys.maxsize.bit_length() + 1, __version__)
 
 REQUEST_TIMEOUT_DNS = 2.5
 REQUEST_RETRIES_DNS = 2
+EDNS_PAYLOAD = 1232
 REQUEST_TIMEOUT_HTTP = 5
 REQUEST_TIMEOUT_SMTP = 5
 THREAD_COUNT_DEFAULT = min(32, os.cpu_count() + 4)
@@ -158,18 +185,16 @@ else:
 devnull = os.devnull
 
 
+@functools.lru_cache(maxsize=1024)
 def domain_tld(domain):
-	try:
-		from tld import parse_tld
-	except ImportError:
-		ctld = ['org', 'com', 'net', 'gov', 'edu', 'co', 'mil', 'nom', 'ac', 'info', 'biz']
+	if not MODULE_TLD:
 		d = domain.rsplit('.', 3)
 		if len(d) < 2:
 			return '', d[0], ''
 		if len(d) == 2:
 			return '', d[0], d[1]
 		if len(d) > 2:
-			if d[-2] in ctld:
+			if d[-2] in COMMON_SLD:
 				return '.'.join(d[:-3]), d[-3], '.'.join(d[-2:])
 			else:
 				return '.'.join(d[:-2]), d[-2], d[-1]
@@ -184,6 +209,12 @@ def domain_tld(domain):
 class Whois():
 	WHOIS_IANA = 'whois.iana.org'
 	TIMEOUT = 2.0
+	MAX_CONNECTIONS = 2
+	REFER_REGEX = re.compile(r'refer:\s+(?P<server>[-.a-z0-9]+)', re.IGNORECASE | re.MULTILINE)
+	FIELDS_REGEX = {
+		'registrar': re.compile(r'[\r\n]registrar[ .]*:\s+(?:name:\s)?(?P<registrar>[^\r\n]+)', re.IGNORECASE | re.MULTILINE),
+		'creation_date': re.compile(r'[\r\n](?:created(?: on)?|creation date|registered(?: on)?)[ .]*:\s+(?P<creation_date>[^\r\n]+)', re.IGNORECASE | re.MULTILINE),
+	}
 	WHOIS_TLD = {
 		'com': 'whois.verisign-grs.com',
 		'net': 'whois.verisign-grs.com',
@@ -205,6 +236,7 @@ class Whois():
 
 	def __init__(self):
 		self.whois_tld = self.WHOIS_TLD
+		self.semaphores = {}
 
 	def _brute_datetime(self, s):
 		formats = ('%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S%z', '%Y-%m-%d %H:%M', '%Y.%m.%d %H:%M',
@@ -219,13 +251,13 @@ class Whois():
 
 	def _extract(self, response):
 		fields = {
-			'registrar': (r'[\r\n]registrar[ .]*:\s+(?:name:\s)?(?P<registrar>[^\r\n]+)', str),
-			'creation_date': (r'[\r\n](?:created(?: on)?|creation date|registered(?: on)?)[ .]*:\s+(?P<creation_date>[^\r\n]+)', self._brute_datetime),
+			'registrar': str,
+			'creation_date': self._brute_datetime,
 		}
 		result = {'text': response}
 		response_reduced = '\r\n'.join([x.strip() for x in response.splitlines() if not x.startswith('%')])
-		for field, (pattern, func) in fields.items():
-			match = re.search(pattern, response_reduced, re.IGNORECASE | re.MULTILINE)
+		for field, func in fields.items():
+			match = self.FIELDS_REGEX[field].search(response_reduced)
 			if match:
 				result[field] = func(match.group(1))
 			else:
@@ -235,10 +267,12 @@ class Whois():
 	def query(self, query, server=None):
 		_, _, tld = domain_tld(query)
 		server = server or self.whois_tld.get(tld, self.WHOIS_IANA)
+		semaphore = self.semaphores.setdefault(server, threading.BoundedSemaphore(self.MAX_CONNECTIONS))
 		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		sock.settimeout(self.TIMEOUT)
 		response = b''
 		try:
+			semaphore.acquire()
 			sock.connect((server, 43))
 			sock.send(query.encode() + b'\r\n')
 			while True:
@@ -252,8 +286,9 @@ class Whois():
 			return ''
 		finally:
 			sock.close()
+			semaphore.release()
 		response = response.decode('utf-8', errors='ignore')
-		refer = re.search(r'refer:\s+(?P<server>[-.a-z0-9]+)', response, re.IGNORECASE | re.MULTILINE)
+		refer = self.REFER_REGEX.search(response)
 		if refer:
 			return self.query(query, refer.group('server'))
 		return response
@@ -263,6 +298,23 @@ class Whois():
 
 
 class UrlOpener():
+	META_URL_REGEX = re.compile(r'<meta[^>]*?url=(https?://[\w.,?!:;/*#@$&+=[\]()%~-]*?)"', re.IGNORECASE)
+	NORMALIZE_REGEX = (
+		(re.compile(b'(action|src|href)=".+"', re.IGNORECASE), lambda m: m.group(0).split(b'=')[0] + b'=""'),
+		(re.compile(b'url(.+)', re.IGNORECASE), b'url()'),
+		)
+	_openers = {}
+
+	@classmethod
+	def _opener(cls, verify):
+		if verify not in cls._openers:
+			if verify:
+				ctx = urllib.request.ssl.create_default_context()
+			else:
+				ctx = urllib.request.ssl._create_unverified_context()
+			cls._openers[verify] = urllib.request.build_opener(urllib.request.HTTPSHandler(context=ctx))
+		return cls._openers[verify]
+
 	def __init__(self, url, timeout=REQUEST_TIMEOUT_HTTP, headers={}, verify=True):
 		http_headers = {'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9',
 			'accept-encoding': 'gzip,identity',
@@ -271,12 +323,8 @@ class UrlOpener():
 			# do not override accepted encoding - only gzip,identity is supported
 			if h.lower() != 'accept-encoding':
 				http_headers[h.lower()] = v
-		if verify:
-			ctx = urllib.request.ssl.create_default_context()
-		else:
-			ctx = urllib.request.ssl._create_unverified_context()
 		request = urllib.request.Request(url, headers=http_headers)
-		with urllib.request.urlopen(request, timeout=timeout, context=ctx) as r:
+		with self._opener(verify).open(request, timeout=timeout) as r:
 			self.headers = r.headers
 			self.code = r.code
 			self.reason = r.reason
@@ -286,22 +334,24 @@ class UrlOpener():
 			self.content = gzip.decompress(self.content)
 		if 64 < len(self.content) < 1024:
 			try:
-				meta_url = re.search(r'<meta[^>]*?url=(https?://[\w.,?!:;/*#@$&+=[\]()%~-]*?)"', self.content.decode(), re.IGNORECASE)
+				meta_url = self.META_URL_REGEX.search(self.content.decode())
 			except Exception:
 				pass
 			else:
 				if meta_url:
 					self.__init__(meta_url.group(1), timeout=timeout, headers=http_headers, verify=verify)
-		self.normalized_content = self._normalize()
+		self._normalized_content = None
+
+	@property
+	def normalized_content(self):
+		if self._normalized_content is None:
+			self._normalized_content = self._normalize()
+		return self._normalized_content
 
 	def _normalize(self):
 		content = b' '.join(self.content.split())
-		mapping = dict({
-			b'(action|src|href)=".+"': lambda m: m.group(0).split(b'=')[0] + b'=""',
-			b'url(.+)': b'url()',
-			})
-		for pattern, repl in mapping.items():
-			content = re.sub(pattern, repl, content, flags=re.IGNORECASE)
+		for regex, repl in self.NORMALIZE_REGEX:
+			content = regex.sub(repl, content)
 		return content
 
 
@@ -690,6 +740,15 @@ class Fuzzer():
 	}
 	keyboards = [qwerty, qwertz, azerty]
 
+	keyboard_neighbors = {}
+	for layout in keyboards:
+		for key, neighbors in layout.items():
+			keyboard_neighbors[key] = ''.join(dict.fromkeys(keyboard_neighbors.get(key, '') + neighbors))
+	del layout, key, neighbors
+
+	bitflips = {chr(o): tuple(chr(o ^ m) for m in (1, 2, 4, 8, 16, 32, 64, 128)
+		if chr(o ^ m) in 'abcdefghijklmnopqrstuvwxyz0123456789-') for o in range(256)}
+
 	def __init__(self, domain, dictionary=[], tld_dictionary=[]):
 		self.subdomain, self.domain, self.tld = domain_tld(domain)
 		self.domain = idna.decode(self.domain)
@@ -704,13 +763,12 @@ class Fuzzer():
 		return
 
 	def _bitsquatting(self):
-		masks = [1, 2, 4, 8, 16, 32, 64, 128]
-		chars = set('abcdefghijklmnopqrstuvwxyz0123456789-')
 		for i, c in enumerate(self.domain):
-			for mask in masks:
-				b = chr(ord(c) ^ mask)
-				if b in chars:
-					yield self.domain[:i] + b + self.domain[i+1:]
+			flips = self.bitflips.get(c)
+			if flips:
+				pre, suf = self.domain[:i], self.domain[i+1:]
+				for b in flips:
+					yield pre + b + suf
 
 	def _cyrillic(self):
 		cdomain = self.domain
@@ -726,54 +784,54 @@ class Fuzzer():
 		glyphs = md(self.glyphs_ascii, self.glyphs_idn_by_tld.get(self.tld, self.glyphs_unicode))
 		def mix(domain):
 			for i, c in enumerate(domain):
+				pre, suf = domain[:i], domain[i+1:]
 				for g in glyphs.get(c, []):
-					yield domain[:i] + g + domain[i+1:]
+					yield pre + g + suf
 			for i in range(len(domain)-1):
 				win = domain[i:i+2]
-				for c in {win[0], win[1], win}:
-					for g in glyphs.get(c, []):
-						yield domain[:i] + win.replace(c, g) + domain[i+2:]
-		result1 = set(mix(self.domain))
-		result2 = set()
-		for r in result1:
-			result2.update(set(mix(r)))
-		return result1 | result2
+				double = win[0] == win[1]
+				if win in glyphs or double and win[0] in glyphs:
+					pre, suf = domain[:i], domain[i+2:]
+					for g in glyphs.get(win, []):
+						yield pre + g + suf
+					if double:
+						for g in glyphs.get(win[0], []):
+							yield pre + g + g + suf
+		result = set(mix(self.domain))
+		for r in list(result):
+			result.update(mix(r))
+		return result
 
 	def _hyphenation(self):
-		return {self.domain[:i] + '-' + self.domain[i:] for i in range(1, len(self.domain))}
+		return (self.domain[:i] + '-' + self.domain[i:] for i in range(1, len(self.domain)))
 
 	def _insertion(self):
-		result = set()
 		for i in range(0, len(self.domain)-1):
 			prefix, orig_c, suffix = self.domain[:i], self.domain[i], self.domain[i+1:]
-			for c in (c for keys in self.keyboards for c in keys.get(orig_c, [])):
-				result.update({
-					prefix + c + orig_c + suffix,
-					prefix + orig_c + c + suffix
-				})
-		return result
+			for c in self.keyboard_neighbors.get(orig_c, ''):
+				yield prefix + c + orig_c + suffix
+				yield prefix + orig_c + c + suffix
 
 	def _omission(self):
-		return {self.domain[:i] + self.domain[i+1:] for i in range(len(self.domain))}
+		return (self.domain[:i] + self.domain[i+1:] for i in range(len(self.domain)))
 
 	def _repetition(self):
-		return {self.domain[:i] + c + self.domain[i:] for i, c in enumerate(self.domain)}
+		return (self.domain[:i] + c + self.domain[i:] for i, c in enumerate(self.domain))
 
 	def _replacement(self):
 		for i, c in enumerate(self.domain):
 			pre = self.domain[:i]
 			suf = self.domain[i+1:]
-			for layout in self.keyboards:
-				for r in layout.get(c, ''):
-					yield pre + r + suf
+			for r in self.keyboard_neighbors.get(c, ''):
+				yield pre + r + suf
 
 	def _subdomain(self):
 		for i in range(1, len(self.domain)-1):
-			if self.domain[i] not in ['-', '.'] and self.domain[i-1] not in ['-', '.']:
+			if self.domain[i] not in '-.' and self.domain[i-1] not in '-.':
 				yield self.domain[:i] + '.' + self.domain[i:]
 
 	def _transposition(self):
-		return {self.domain[:i] + self.domain[i+1] + self.domain[i] + self.domain[i+2:] for i in range(len(self.domain)-1)}
+		return (self.domain[:i] + self.domain[i+1] + self.domain[i] + self.domain[i+2:] for i in range(len(self.domain)-1) if self.domain[i] != self.domain[i+1])
 
 	def _vowel_swap(self):
 		vowels = 'aeiou'
@@ -788,12 +846,15 @@ class Fuzzer():
 
 
 	def _addition(self):
-		result = set()
+		chars = '0123456789abcdefghijklmnopqrstuvwxyz'
 		if '-' in self.domain:
 			parts = self.domain.split('-')
-			result = {'-'.join(parts[:p]) + chr(i) + '-' + '-'.join(parts[p:]) for i in (*range(48, 58), *range(97, 123)) for p in range(1, len(parts))}
-		result.update({self.domain + chr(i) for i in (*range(48, 58), *range(97, 123))})
-		return result
+			for p in range(1, len(parts)):
+				pre, suf = '-'.join(parts[:p]), '-' + '-'.join(parts[p:])
+				for c in chars:
+					yield pre + c + suf
+		for c in chars:
+			yield self.domain + c
 
 
 	def _dictionary(self):
@@ -822,8 +883,23 @@ class Fuzzer():
 
 	def generate(self, fuzzers=[]):
 		self.domains = set()
+		seen = set()
+		def _add(fuzzer, domain):
+			if domain in seen:
+				return
+			seen.add(domain)
+			# lowercase ASCII encodes to itself, idna still checks anything else
+			if not (domain.isascii() and domain.islower() and '--' not in domain and '.-' not in domain and domain[-1] != '-'):
+				try:
+					domain = idna.encode(domain).decode()
+				except Exception:
+					return
+			if VALID_FQDN_REGEX.match(domain):
+				self.domains.add(Permutation(fuzzer=fuzzer, domain=domain))
 		if not fuzzers or '*original' in fuzzers:
-			self.domains.add(Permutation(fuzzer='*original', domain='.'.join(filter(None, [self.subdomain, self.domain, self.tld]))))
+			_add('*original', '.'.join(filter(None, [self.subdomain, self.domain, self.tld])))
+		head = self.subdomain + '.' if self.subdomain else ''
+		tail = '.' + self.tld if self.tld else ''
 		for f_name in fuzzers or [
 			'addition', 'bitsquatting', 'cyrillic', 'homoglyph', 'hyphenation',
 			'insertion', 'omission', 'plural', 'repetition', 'replacement',
@@ -835,34 +911,24 @@ class Fuzzer():
 				pass
 			else:
 				for domain in f():
-					self.domains.add(Permutation(fuzzer=f_name, domain='.'.join(filter(None, [self.subdomain, domain, self.tld]))))
+					_add(f_name, head + domain + tail if domain else '.'.join(filter(None, [self.subdomain, self.tld])))
 		if not fuzzers or 'tld-swap' in fuzzers:
 			for tld in self._tld():
-				self.domains.add(Permutation(fuzzer='tld-swap', domain='.'.join(filter(None, [self.subdomain, self.domain, tld]))))
+				_add('tld-swap', head + self.domain + '.' + tld)
 		if not fuzzers or 'various' in fuzzers:
 			if '.' in self.tld:
-				self.domains.add(Permutation(fuzzer='various', domain='.'.join(filter(None, [self.subdomain, self.domain, self.tld.split('.')[-1]]))))
-				self.domains.add(Permutation(fuzzer='various', domain='.'.join(filter(None, [self.subdomain, self.domain + self.tld]))))
+				_add('various', '.'.join(filter(None, [self.subdomain, self.domain, self.tld.split('.')[-1]])))
+				_add('various', '.'.join(filter(None, [self.subdomain, self.domain + self.tld])))
 			if '.' not in self.tld:
-				self.domains.add(Permutation(fuzzer='various', domain='.'.join(filter(None, [self.subdomain, self.domain + self.tld, self.tld]))))
+				_add('various', '.'.join(filter(None, [self.subdomain, self.domain + self.tld, self.tld])))
 			if self.tld != 'com' and '.' not in self.tld:
-				self.domains.add(Permutation(fuzzer='various', domain='.'.join(filter(None, [self.subdomain, self.domain + '-' + self.tld, 'com']))))
-				self.domains.add(Permutation(fuzzer='various', domain='.'.join(filter(None, [self.subdomain, self.domain + self.tld, 'com']))))
+				_add('various', '.'.join(filter(None, [self.subdomain, self.domain + '-' + self.tld, 'com'])))
+				_add('various', '.'.join(filter(None, [self.subdomain, self.domain + self.tld, 'com'])))
 			if self.subdomain:
-				self.domains.add(Permutation(fuzzer='various', domain='.'.join([self.subdomain + self.domain, self.tld])))
-				self.domains.add(Permutation(fuzzer='various', domain='.'.join([self.subdomain.replace('.', '') + self.domain, self.tld])))
-				self.domains.add(Permutation(fuzzer='various', domain='.'.join([self.subdomain + '-' + self.domain, self.tld])))
-				self.domains.add(Permutation(fuzzer='various', domain='.'.join([self.subdomain.replace('.', '-') + '-' + self.domain, self.tld])))
-		def _punycode(domain):
-			try:
-				domain['domain'] = idna.encode(domain['domain']).decode()
-			except Exception:
-				domain['domain'] = ''
-			return domain
-		self.domains = set(map(_punycode, self.domains))
-		for domain in self.domains.copy():
-			if not VALID_FQDN_REGEX.match(domain.get('domain')):
-				self.domains.discard(domain)
+				_add('various', '.'.join([self.subdomain + self.domain, self.tld]))
+				_add('various', '.'.join([self.subdomain.replace('.', '') + self.domain, self.tld]))
+				_add('various', '.'.join([self.subdomain + '-' + self.domain, self.tld]))
+				_add('various', '.'.join([self.subdomain.replace('.', '-') + '-' + self.domain, self.tld]))
 
 	def permutations(self, registered=False, unregistered=False, dns_all=False, unicode=False):
 		if (registered and not unregistered):
@@ -881,7 +947,8 @@ class Fuzzer():
 			domains = map(_cutdns, domains)
 		if unicode:
 			def _punydecode(x):
-				x.domain = idna.decode(x.domain)
+				if 'xn--' in x.domain:
+					x.domain = idna.decode(x.domain)
 				return x
 			domains = map(_punydecode, domains)
 		return sorted(domains)
@@ -907,6 +974,9 @@ class Scanner(threading.Thread):
 		self.option_mxcheck = False
 		self.nameservers = []
 		self.useragent = ''
+		self.http_conns = {}
+		self.smtp_banners = {}
+		self.finished = 0
 
 	@staticmethod
 	def _send_recv_tcp(host, port, data=b'', timeout=2.0, recv_bytes=1024):
@@ -924,24 +994,161 @@ class Scanner(threading.Thread):
 			sock.close()
 		return resp.decode('utf-8', errors='ignore')
 
+	@staticmethod
+	def _bulk_query(questions, nameservers, port=53, timeout=REQUEST_TIMEOUT_DNS, payload=EDNS_PAYLOAD):
+		r'''
+		Sends queries for all (name, rdtype) questions back-to-back over UDP and
+		matches the responses by message ID. Queries still pending halfway through
+		the timeout are sent again, to the next nameserver if there is more than
+		one. NOERROR, NXDOMAIN and truncated answers are final; other errors are
+		kept only if no nameserver did better. Truncated answers should be retried
+		with the regular resolver. Questions which timed out are missing from the
+		result.
+		'''
+		queries = {}
+		for qname, rdtype in questions:
+			q = dns.message.make_query(qname, rdtype, use_edns=0, payload=payload)
+			while q.id in queries:
+				q.id = random.randint(0, 65535)
+			queries[q.id] = ((qname, rdtype), q)
+		responses = {}
+		errors = {}
+		nameservers = random.sample(nameservers, len(nameservers))
+		socks = {}
+		sources = set()
+		try:
+			expiration = time.monotonic() + timeout
+			for attempt, deadline in enumerate((expiration - timeout / 2, expiration)):
+				ns = nameservers[attempt % len(nameservers)]
+				family = socket.AF_INET6 if ':' in ns else socket.AF_INET
+				try:
+					if family not in socks:
+						socks[family] = socket.socket(family, socket.SOCK_DGRAM)
+					for key, q in queries.values():
+						if key not in responses:
+							socks[family].sendto(q.to_wire(), (ns, port))
+				except OSError as e:
+					# e.g. no route to an IPv6 nameserver, move on to the next one
+					_debug(e)
+					continue
+				sources.add((ns, port))
+				failed = set()
+				while len(responses) + len(failed) < len(queries):
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						break
+					readable, _, _ = select.select(list(socks.values()), [], [], remaining)
+					if not readable:
+						break
+					for sock in readable:
+						try:
+							wire, source = sock.recvfrom(65535)
+						except OSError as e:
+							_debug(e)
+							continue
+						if source[:2] not in sources:
+							continue
+						try:
+							r = dns.message.from_wire(wire)
+						except Exception as e:
+							_debug(e)
+							continue
+						key, q = queries.get(r.id, (None, None))
+						if not q or not q.is_response(r):
+							continue
+						if r.flags & dns.flags.TC or r.rcode() in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+							responses[key] = r
+							failed.discard(key)
+						elif key not in responses:
+							# SERVFAIL, REFUSED etc. - ask the next nameserver
+							errors[key] = r
+							failed.add(key)
+				if len(responses) == len(queries):
+					break
+		except Exception as e:
+			_debug(e)
+		finally:
+			for sock in socks.values():
+				sock.close()
+		for key, r in errors.items():
+			responses.setdefault(key, r)
+		return responses
+
+	@staticmethod
+	def _chase_answer(response, rdtype):
+		name = response.question[0].name
+		for _ in range(16):
+			cname = None
+			for rrset in response.answer:
+				if rrset.name != name:
+					continue
+				if rrset.rdtype == rdtype:
+					return rrset
+				if rrset.rdtype == dns.rdatatype.CNAME:
+					cname = rrset[0].target
+			if cname is None:
+				break
+			name = cname
+		return None
+
+	def _send_recv_http(self, host, data, timeout=2.0, max_conns=16, max_bytes=8192):
+		sock = self.http_conns.pop(host, None)
+		for reused in ((True, False) if sock else (False,)):
+			if not reused:
+				sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+				sock.settimeout(timeout)
+				try:
+					sock.connect((host, 80))
+				except Exception as e:
+					_debug(e)
+					sock.close()
+					return ''
+			resp = b''
+			try:
+				sock.send(data)
+				while b'\r\n\r\n' not in resp and len(resp) < max_bytes:
+					buf = sock.recv(1024)
+					if not buf:
+						break
+					resp += buf
+			except Exception as e:
+				_debug(e)
+			if resp or not reused:
+				break
+			sock.close() # stale keep-alive connection
+		if b'\r\n\r\n' in resp and b'\nconnection: close' not in resp.lower():
+			if len(self.http_conns) >= max_conns:
+				self.http_conns.pop(next(iter(self.http_conns))).close()
+			self.http_conns[host] = sock
+		else:
+			sock.close()
+		return resp.decode('utf-8', errors='ignore')
+
 	def _banner_http(self, ip, vhost):
-		response = self._send_recv_tcp(ip, 80,
-			'HEAD / HTTP/1.1\r\nHost: {}\r\nUser-Agent: {}\r\n\r\n'.format(vhost, self.useragent).encode())
+		response = self._send_recv_http(ip,
+			'HEAD / HTTP/1.1\r\nHost: {}\r\nUser-Agent: {}\r\nConnection: keep-alive\r\n\r\n'.format(vhost, self.useragent).encode())
 		if not response:
 			return ''
-		headers = response.splitlines()
-		for field in headers:
-			if field.lower().startswith('server: '):
-				return field[8:]
-		return ''
+		start = response.lower().find('\nserver: ')
+		if start < 0:
+			status = response.split('\n', 1)[0].rstrip('\r').split(' ', 2)
+			if len(status) > 1 and status[0].startswith('HTTP/'):
+				return 'HTTP ' + status[1]
+			return ''
+		start += 9
+		end = response.find('\n', start)
+		return response[start:end if end >= 0 else None].rstrip('\r')
 
 	def _banner_smtp(self, mx):
+		if mx in self.smtp_banners:
+			return self.smtp_banners[mx]
 		response = self._send_recv_tcp(mx, 25)
 		if not response:
 			return ''
 		hello = response.splitlines()[0]
 		if hello.startswith('220'):
-			return hello[4:].strip()
+			self.smtp_banners[mx] = hello[4:].strip()
+			return self.smtp_banners[mx]
 		return ''
 
 	def _mxcheck(self, mxhost, domain_from, domain_rcpt):
@@ -983,110 +1190,123 @@ class Scanner(threading.Thread):
 	def is_stopped(self):
 		return self._stop_event.is_set()
 
+	@staticmethod
+	@functools.lru_cache(maxsize=None)
+	def _resolver(nameservers=()):
+		if nameservers:
+			resolv = Resolver(configure=False)
+			resolv.nameservers = list(nameservers)
+		else:
+			resolv = Resolver()
+			resolv.search = []
+
+		resolv.lifetime = REQUEST_TIMEOUT_DNS * REQUEST_RETRIES_DNS
+		resolv.timeout = REQUEST_TIMEOUT_DNS
+		resolv.use_edns(edns=True, ednsflags=0, payload=EDNS_PAYLOAD)
+		resolv.rotate = True
+		return resolv
+
 	def run(self):
 		if self.option_extdns:
-			if self.nameservers:
-				resolv = Resolver(configure=False)
-				resolv.nameservers = self.nameservers
-			else:
-				resolv = Resolver()
-				resolv.search = []
-
-			resolv.lifetime = REQUEST_TIMEOUT_DNS * REQUEST_RETRIES_DNS
-			resolv.timeout = REQUEST_TIMEOUT_DNS
-			EDNS_PAYLOAD = 1232
-			resolv.use_edns(edns=True, ednsflags=0, payload=EDNS_PAYLOAD)
-			resolv.rotate = True
+			resolv = self._resolver(tuple(self.nameservers))
 
 			if hasattr(resolv, 'resolve'):
 				resolve = resolv.resolve
 			else:
 				resolve = resolv.query
 
+			# DNS-over-HTTPS servers cannot take part in bulk UDP queries
+			udp_nameservers = [str(ns) for ns in resolv.nameservers if not str(ns).startswith('https://')]
+
 		if self.option_geoip:
 			geo = geoip()
 
 		if self.option_phash:
 			browser = HeadlessBrowser(useragent=self.useragent)
 
-		_answer_to_list = lambda ans: sorted([str(x).split(' ')[-1].rstrip('.') for x in ans])
+		if self.option_lsh == 'ssdeep':
+			# ssdeep can only score hashes with the same or an adjacent block size
+			blocksize = int(self.lsh_init.split(':', 1)[0])
+			ssdeep_blocksizes = {str(blocksize), str(blocksize * 2), str(blocksize // 2)}
 
-		while not self.is_stopped():
-			try:
-				task = self.jobs.get(block=False)
-			except queue.Empty:
-				self.stop()
-				return
-
-			domain = task.get('domain')
-
-			dns_a = False
-			dns_aaaa = False
-			if self.option_extdns:
-				nxdomain = False
-				dns_ns = False
-				dns_mx = False
+		_answer_to_list = lambda ans: sorted([str(x).split(' ')[-1].rstrip('.') for x in ans])
+		_resolved = lambda task, key: key in task and task[key] != ['!ServFail']
 
+		def _lookup(task, key, rdtype, response=None):
+			# returns False if the domain name does not exist
+			if response is None:
 				try:
-					task['dns_ns'] = _answer_to_list(resolve(domain, rdtype=dns.rdatatype.NS))
-					dns_ns = True
+					answer = resolve(task['domain'], rdtype=rdtype, raise_on_no_answer=False)
 				except NXDOMAIN:
-					nxdomain = True
+					return False
 				except NoNameservers:
-					task['dns_ns'] = ['!ServFail']
+					task[key] = ['!ServFail']
 				except DNSException as e:
 					_debug(e)
+				else:
+					if answer.rrset:
+						task[key] = _answer_to_list(answer)
+			elif response.rcode() == dns.rcode.NOERROR:
+				answer = self._chase_answer(response, rdtype)
+				if answer:
+					task[key] = _answer_to_list(answer)
+			elif response.rcode() == dns.rcode.NXDOMAIN:
+				return False
+			else:
+				task[key] = ['!ServFail']
+			return True
 
-				if nxdomain is False:
-					try:
-						task['dns_a'] = _answer_to_list(resolve(domain, rdtype=dns.rdatatype.A))
-						dns_a = True
-					except NoNameservers:
-						task['dns_a'] = ['!ServFail']
-					except DNSException as e:
-						_debug(e)
+		def _bulk_lookup(queries):
+			if not udp_nameservers or not queries:
+				return [_lookup(t, k, r) for t, k, r in queries]
+			questions = [(t['domain'], r) for t, _, r in queries]
+			responses = {}
+			for _ in range(2):
+				pending = [q for q in questions if q not in responses]
+				if pending:
+					responses.update(self._bulk_query(pending, udp_nameservers,
+						port=resolv.port, timeout=REQUEST_TIMEOUT_DNS, payload=EDNS_PAYLOAD))
+			results = []
+			for (task, key, rdtype), question in zip(queries, questions):
+				response = responses.get(question)
+				if response is None:
+					# no nameserver replied, same as a resolver timeout
+					results.append(True)
+				elif response.flags & dns.flags.TC:
+					# the resolver retries over TCP
+					results.append(_lookup(task, key, rdtype))
+				else:
+					results.append(_lookup(task, key, rdtype, response))
+			return results
 
-					try:
-						task['dns_aaaa'] = _answer_to_list(resolve(domain, rdtype=dns.rdatatype.AAAA))
-						dns_aaaa = True
-					except NoNameservers:
-						task['dns_aaaa'] = ['!ServFail']
-					except DNSException as e:
-						_debug(e)
+		def _scan(task, new):
+			domain = task.get('domain')
 
-				if nxdomain is False and dns_ns is True:
-					try:
-						task['dns_mx'] = _answer_to_list(resolve(domain, rdtype=dns.rdatatype.MX))
-						dns_mx = True
-					except NoNameservers:
-						task['dns_mx'] = ['!ServFail']
-					except DNSException as e:
-						_debug(e)
-			else:
+			if new and not self.option_extdns:
 				try:
-					addrinfo = socket.getaddrinfo(domain, None, proto=socket.IPPROTO_TCP)
+					addrinfo = socket.getaddrinfo(domain, None, type=socket.SOCK_STREAM)
 				except socket.gaierror as e:
 					if e.errno == -3:
 						task['dns_a'] = ['!ServFail']
 				except Exception as e:
 					_debug(e)
 				else:
-					for _, _, _, _, sa in addrinfo:
-						ip = sa[0]
-						if '.' in ip:
-							if 'dns_a' not in task:
-								task['dns_a'] = set()
-								dns_a = True
-							task['dns_a'].add(ip)
-						if ':' in ip:
-							if 'dns_aaaa' not in task:
-								task['dns_aaaa'] = set()
-								dns_aaaa = True
-							task['dns_aaaa'].add(ip)
-					if 'dns_a' in task:
-						task['dns_a'] = list(task['dns_a'])
-					if 'dns_aaaa' in task:
-						task['dns_aaaa'] = list(task['dns_aaaa'])
+					keys = {socket.AF_INET: 'dns_a', socket.AF_INET6: 'dns_aaaa'}
+					for family, _, _, _, sa in addrinfo:
+						key = keys.get(family)
+						if key:
+							task.setdefault(key, [])
+							if sa[0] not in task[key]:
+								task[key].append(sa[0])
+
+			dns_a = _resolved(task, 'dns_a')
+			dns_aaaa = _resolved(task, 'dns_aaaa')
+			dns_mx = _resolved(task, 'dns_mx')
+
+			if new and slow_checks and (dns_a or dns_aaaa or dns_mx):
+				# spread the slow checks across all threads
+				self.jobs.put(task)
+				return True
 
 			if self.option_mxcheck:
 				if dns_mx is True:
@@ -1148,13 +1368,62 @@ class Scanner(threading.Thread):
 							if self.option_lsh == 'ssdeep':
 								lsh_curr = ssdeep.hash(r.normalized_content)
 								if lsh_curr not in (None, '3::'):
-									task['ssdeep'] = ssdeep.compare(self.lsh_init, lsh_curr)
+									if lsh_curr.split(':', 1)[0] in ssdeep_blocksizes:
+										task['ssdeep'] = ssdeep.compare(self.lsh_init, lsh_curr)
+									else:
+										task['ssdeep'] = 0
 							elif self.option_lsh == 'tlsh':
 								lsh_curr = tlsh.hash(r.normalized_content)
 								if lsh_curr not in (None, '', 'TNULL'):
 									task['tlsh'] = int(100 - (min(tlsh.diff(self.lsh_init, lsh_curr), 300)/3))
 
-			self.jobs.task_done()
+
+		batch_size = 16 if self.option_extdns else 1
+		slow_checks = self.option_mxcheck or self.option_banners or self.option_lsh or self.option_phash or self.screenshot_dir
+
+		while not self.is_stopped():
+			try:
+				tasks = [self.jobs.get(timeout=0.5)]
+			except queue.Empty:
+				if self.jobs.unfinished_tasks:
+					# other threads might still hand back resolved domains
+					continue
+				self.stop()
+				break
+			while len(tasks) < batch_size and not tasks[-1].is_registered():
+				try:
+					tasks.append(self.jobs.get(block=False))
+				except queue.Empty:
+					break
+			fresh = [not task.is_registered() for task in tasks]
+
+			try:
+				if self.option_extdns:
+					fresh_tasks = [task for task, new in zip(tasks, fresh) if new]
+					queries = [(task, 'dns_ns', dns.rdatatype.NS) for task in fresh_tasks]
+					existing = [task for task, exists in zip(fresh_tasks, _bulk_lookup(queries)) if exists]
+					queries = []
+					for task in existing:
+						queries.append((task, 'dns_a', dns.rdatatype.A))
+						queries.append((task, 'dns_aaaa', dns.rdatatype.AAAA))
+						if _resolved(task, 'dns_ns'):
+							queries.append((task, 'dns_mx', dns.rdatatype.MX))
+					_bulk_lookup(queries)
+
+				for task, new in zip(tasks, fresh):
+					try:
+						if _scan(task, new):
+							continue
+					except Exception as e:
+						_debug(e)
+					self.finished += 1
+			finally:
+				for _ in tasks:
+					self.jobs.task_done()
+
+		for sock in self.http_conns.values():
+			sock.close()
+		self.http_conns.clear()
 
 
 class Format():
@@ -1170,21 +1439,12 @@ class Format():
 			for k in domain.keys() - cols:
 				cols.append(k)
 		cols = cols[:2] + sorted(cols[2:])
-		csv = [','.join(cols)]
+		buf = StringIO()
+		writer = csv.writer(buf, lineterminator='\n')
+		writer.writerow(cols)
 		for domain in self.domains:
-			row = []
-			for val in [domain.get(c, '') for c in cols]:
-				if isinstance(val, str):
-					if ',' in val:
-						row.append('"{}"'.format(val))
-					else:
-						row.append(val)
-				elif isinstance(val, list):
-					row.append(';'.join(val))
-				elif isinstance(val, int):
-					row.append(str(val))
-			csv.append(','.join(row))
-		return '\n'.join(csv)
+			writer.writerow([';'.join(val) if isinstance(val, list) else val for val in [domain.get(c, '') for c in cols]])
+		return buf.getvalue().rstrip('\n')
 
 	def list(self):
 		return '\n'.join([x.get('domain') for x in sorted(self.domains)])
@@ -1194,9 +1454,10 @@ class Format():
 		domains = list(self.domains)
 		if sys.stdout.encoding.lower() == 'utf-8':
 			for domain in domains:
-				domain.update(domain=idna.decode(domain.get('domain')))
-		wfuz = max([len(x.get('fuzzer', '')) for x in domains]) + 1
-		wdom = max([len(x.get('domain', '')) for x in domains]) + 1
+				if 'xn--' in domain.get('domain'):
+					domain.update(domain=idna.decode(domain.get('domain')))
+		wfuz = max(len(x.get('fuzzer', '')) for x in domains) + 1
+		wdom = max(len(x.get('domain', '')) for x in domains) + 1
 		kv = lambda k, v: FG_YEL + k + FG_CYA + v + FG_RST if k else FG_CYA + v + FG_RST
 		for domain in domains:
 			inf = []
@@ -1301,7 +1562,7 @@ def run(**kwargs):
 	jobs = queue.Queue()
 
 	def p_cli(text):
-		if args.format == 'cli' and sys.stdout.isatty(): print(text, end='', flush=True)
+		if interactive: print(text, end='', flush=True)
 	def p_err(text):
 		print(str(text), file=sys.stderr, flush=True)
 
@@ -1405,6 +1666,7 @@ def run(**kwargs):
 		except OSError as err:
 			parser.error('unable to open {} ({})'.format(args.output, err.strerror.lower()))
 
+	interactive = args.format == 'cli' and sys.stdout.isatty()
 
 	lsh_url = None
 	if args.lsh:
@@ -1526,7 +1788,8 @@ r'''     _           _            _     _
 		jobs.put(task)
 
 	sid = int.from_bytes(os.urandom(4), sys.byteorder)
-	for _ in range(args.threads):
+	smtp_banners = {}
+	for _ in range(min(args.threads, len(domains))):
 		worker = Scanner(jobs)
 		worker.id = sid
 		worker.url = url
@@ -1535,6 +1798,7 @@ r'''     _           _            _     _
 			worker.option_geoip = True
 		if args.banners:
 			worker.option_banners = True
+			worker.smtp_banners = smtp_banners
 		if args.lsh and lsh_init:
 			worker.option_lsh = args.lsh
 			worker.lsh_init = lsh_init
@@ -1551,26 +1815,39 @@ r'''     _           _            _     _
 		worker.start()
 		threads.append(worker)
 
-	p_cli('started {} scanner threads\n'.format(args.threads))
+	p_cli('started {} scanner threads\n'.format(len(threads)))
+
+	jobs_done = threading.Event()
 
-	ttime = 0
+	def _wait_jobs():
+		with jobs.all_tasks_done:
+			while jobs.unfinished_tasks and not jobs_done.is_set():
+				jobs.all_tasks_done.wait(1.0)
+		jobs_done.set()
+
+	threading.Thread(target=_wait_jobs, daemon=True).start()
+
+	tstart = time.monotonic()
 	ival = 0.2
-	while True:
-		time.sleep(ival)
-		ttime += ival
-		dlen = len(domains)
-		comp = dlen - jobs.qsize()
-		if not comp:
-			continue
-		rate = int(comp / ttime) + 1
-		eta = jobs.qsize() // rate
-		found = sum([1 for x in domains if x.is_registered()])
-		p_cli(ST_CLR + '\rpermutations: {:.2%} of {} | found: {} | eta: {:d}m {:02d}s | speed: {:d} qps'.format(comp/dlen,
-			dlen, found, eta//60, eta%60, rate))
-		if jobs.empty():
-			break
-		if sum([1 for x in threads if x.is_alive()]) == 0:
-			break
+	try:
+		while True:
+			finished = jobs_done.wait(ival)
+			ttime = time.monotonic() - tstart
+			dlen = len(domains)
+			comp = sum(worker.finished for worker in threads)
+			pending = dlen - comp
+			if comp:
+				rate = int(comp / ttime) + 1
+				eta = pending // rate
+				found = sum(1 for x in domains if x.is_registered())
+				p_cli(ST_CLR + '\rpermutations: {:.2%} of {} | found: {} | eta: {:d}m {:02d}s | speed: {:d} qps'.format(comp/dlen,
+					dlen, found, eta//60, eta%60, rate))
+			if finished:
+				break
+			if sum([1 for x in threads if x.is_alive()]) == 0:
+				break
+	finally:
+		jobs_done.set()
 	p_cli('\n')
 
 	for worker in threads:
@@ -1581,19 +1858,33 @@ r'''     _           _            _     _
 	domains = fuzz.permutations(registered=args.registered, unregistered=args.unregistered, dns_all=args.all)
 
 	if args.whois:
-		total = sum([1 for x in domains if x.is_registered()])
+		registered = {}
+		for domain in domains:
+			if domain.is_registered():
+				registered.setdefault('.'.join(domain_tld(domain['domain'])[1:]), []).append(domain)
 		whois = Whois()
-		for i, domain in enumerate([x for x in domains if x.is_registered()]):
-			p_cli(ST_CLR + '\rWHOIS: {} ({:.2%})'.format(domain['domain'], (i+1)/total))
-			try:
-				wreply = whois.whois('.'.join(domain_tld(domain['domain'])[1:]))
-			except Exception as e:
-				_debug(e)
-			else:
-				if wreply.get('creation_date'):
-					domain['whois_created'] = wreply.get('creation_date').strftime('%Y-%m-%d')
-				if wreply.get('registrar'):
-					domain['whois_registrar'] = wreply.get('registrar')
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.threads)
+		try:
+			futures = {executor.submit(whois.whois, name): name for name in registered}
+			last = 0
+			for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+				if time.monotonic() - last >= ival or i == len(futures):
+					p_cli(ST_CLR + '\rWHOIS: {} ({:.2%})'.format(futures[future], i/len(futures)))
+					last = time.monotonic()
+				try:
+					wreply = future.result()
+				except Exception as e:
+					_debug(e)
+				else:
+					for domain in registered[futures[future]]:
+						if wreply.get('creation_date'):
+							domain['whois_created'] = wreply.get('creation_date').strftime('%Y-%m-%d')
+						if wreply.get('registrar'):
+							domain['whois_registrar'] = wreply.get('registrar')
+		except KeyboardInterrupt:
+			executor.shutdown(wait=False, cancel_futures=True)
+			raise
+		executor.shutdown()
 		p_cli('\n')
 
 	p_cli('\n')